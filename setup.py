@@ -19,9 +19,7 @@ setup(
     url='https://github.com/miki725/xunitmerge',
     packages=find_packages(exclude=['test', 'test.*']),
     scripts=['bin/xunitmerge'],
-    install_requires=[
-        'six',
-    ],
+    python_requires='>=3.4',
     keywords=' '.join([
         'xunit',
         'reports',
@@ -1,23 +1,75 @@
 from __future__ import unicode_literals, print_function
+import codecs
+import io
+import os
+import re
+import shutil
+import uuid
 from contextlib import contextmanager
+from itertools import chain
 from xml.etree import ElementTree as etree
-from xml.sax.saxutils import quoteattr
-
-import six
+from xml.sax.saxutils import escape, quoteattr
 
 
 CNAME_TAGS = ('system-out', 'skipped', 'error', 'failure')
-CNAME_PATTERN = '<![CDATA[{}]]>'
-TAG_PATTERN = '<{tag}{attrs}>{text}</{tag}>'
+CNAME_SET = frozenset(CNAME_TAGS)
+QUOTEATTR_CACHE_SIZE = 4096
+OUTPUT_BUFFER_SIZE = 1 << 20
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
 
+# used by merge_xunit_raw which slices reports without parsing them
+RAW_ROOT_RE = re.compile(
+    br'(?:\s+|<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>)*<([^\s/>]+)([^>]*)>',
+    re.DOTALL,
+)
+RAW_DECL_RE = re.compile(
+    br'<\?xml\s[^>]*?\bencoding\s*=\s*(?:"([^"]*)"|\'([^\']*)\')',
+)
+RAW_ATTR_RE = re.compile(br'([^\s=/]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+RAW_TESTCASE_RE = re.compile(
+    br'<testcase\b(?:[^>]*?/>|.*?</testcase\s*>)',
+    re.DOTALL,
+)
+NOT_FLAT_ERROR = (
+    '{} is not a flat report with testcases directly under the root '
+    'so it cannot be merged without parsing'
+)
+NOT_UTF8_ERROR = (
+    '{} is not utf-8 encoded so it cannot be merged without parsing'
+)
+NAMESPACES_ERROR = (
+    '{} declares namespaces which the first report does not declare '
+    'so it cannot be merged without parsing'
+)
+# only whitespace and comments are allowed between testcases
+RAW_GAP_RE = re.compile(br'(?:\s+|<!--.*?-->)*', re.DOTALL)
+RAW_END_RE = re.compile(
+    br'(?:\s+|<!--.*?-->)*</([^\s>]+)\s*>(?:\s+|<!--.*?-->)*',
+    re.DOTALL,
+)
 
-@contextmanager
-def patch_etree_cname(etree):
+_quoteattr_cache = {}
+
+
+def _quoteattr(value, _cache=_quoteattr_cache):
     """
-    Patch ElementTree's _serialize_xml function so that it will
-    write text as CDATA tag for tags tags defined in CNAME_TAGS.
+    Memoized quoteattr. XUnit reports repeat the same attribute
+    values (error types, messages) over and over again.
+    """
+    quoted = _cache.get(value)
+    if quoted is None:
+        if len(_cache) >= QUOTEATTR_CACHE_SIZE:
+            _cache.clear()
+        quoted = _cache[value] = quoteattr(value)
+    return quoted
+
 
-    >>> import re
+def serialize(tree, fh):
+    """
+    Write the given ElementTree as xml into the text file object ``fh``.
+    Text of tags defined in CNAME_TAGS is written as CDATA.
+
+    >>> import io, re
     >>> from xml.etree import ElementTree
     >>> xml_string = '''
     ... <testsuite name="nosetests" tests="1" errors="0" failures="0" skip="0">
@@ -35,45 +87,327 @@ def patch_etree_cname(etree):
     ...     </testcase>
     ... </testsuite>
     ... '''
-    >>> tree = ElementTree.fromstring(xml_string)
-    >>> with patch_etree_cname(ElementTree):
-    ...    saved = str(ElementTree.tostring(tree))
+    >>> tree = ElementTree.ElementTree(ElementTree.fromstring(xml_string))
+    >>> fh = io.StringIO()
+    >>> serialize(tree, fh)
+    >>> saved = fh.getvalue()
     >>> systemout = re.findall(r'(<system-out>.*?</system-out>)', saved)[0]
     >>> print(systemout)
     <system-out><![CDATA[Some output here]]></system-out>
     >>> skipped = re.findall(r'(<skipped.*?</skipped>)', saved)[0]
     >>> print(skipped)
-    <skipped message="Skipped" type="unittest.case.SkipTest"><![CDATA[Skipped]]></skipped>
+    <skipped type="unittest.case.SkipTest" message="Skipped"><![CDATA[Skipped]]></skipped>
     >>> error = re.findall(r'(<error.*?</error>)', saved)[0]
     >>> print(error)
-    <error message="Error here" type="KeyError"><![CDATA[Error here]]></error>
+    <error type="KeyError" message="Error here"><![CDATA[Error here]]></error>
     >>> failure = re.findall(r'(<failure.*?</failure>)', saved)[0]
     >>> print(failure)
-    <failure message="Failure here" type="AssertionError"><![CDATA[Failure here]]></failure>
-    """
-    original_serialize = etree._serialize_xml
-
-    def _serialize_xml(write, elem, *args, **kwargs):
-        if elem.tag in CNAME_TAGS:
-            attrs = ' '.join(
-                ['{}={}'.format(k, quoteattr(v))
-                 for k, v in sorted(elem.attrib.items())]
-            )
-            attrs = ' ' + attrs if attrs else ''
-            text = CNAME_PATTERN.format(elem.text)
-            write(TAG_PATTERN.format(
-                tag=elem.tag,
-                attrs=attrs,
-                text=text
-            ).encode('utf-8'))
+    <failure type="AssertionError" message="Failure here"><![CDATA[Failure here]]></failure>
+
+    Namespaced tags and attributes are written with prefixes which
+    are declared on the root element:
+
+    >>> tree = ElementTree.ElementTree(ElementTree.fromstring(
+    ...     '<testsuite xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    ...     'xsi:noNamespaceSchemaLocation="junit.xsd" tests="1">'
+    ...     '<testcase name="test_foo" xsi:type="case" /></testsuite>'
+    ... ))
+    >>> fh = io.StringIO()
+    >>> serialize(tree, fh)
+    >>> print(fh.getvalue())
+    <?xml version='1.0' encoding='utf-8'?>
+    <testsuite xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="junit.xsd" tests="1"><testcase name="test_foo" xsi:type="case" /></testsuite>
+    """
+    root = tree.getroot()
+    namespaces = collect_namespaces(root.iter())
+
+    fh.write("<?xml version='1.0' encoding='utf-8'?>\n")
+    _serialize_element(fh.write, root, {}, namespaces,
+                       namespace_declarations(namespaces))
+
+
+def collect_namespaces(elements):
+    """
+    Assign a prefix to every namespace used by the tags
+    or attribute names of the given elements.
+    """
+    namespaces = {}
+    for elem in elements:
+        tag = elem.tag
+        # comments and processing instructions have functions as tags
+        if isinstance(tag, str) and tag[:1] == '{':
+            _add_namespace(namespaces, tag)
+        for name in elem.keys():
+            if name[:1] == '{':
+                _add_namespace(namespaces, name)
+    return namespaces
+
+
+def _add_namespace(namespaces, name):
+    uri = name[1:].split('}', 1)[0]
+    if uri not in namespaces:
+        namespaces[uri] = _new_prefix(uri, namespaces)
+
+
+def _new_prefix(uri, namespaces):
+    """
+    Pick a prefix for the namespace uri which is not used yet. Prefixes
+    registered with ElementTree.register_namespace are preferred.
+    """
+    if uri == XML_NAMESPACE:
+        return 'xml'
+    used = set(namespaces.values())
+    prefix = etree._namespace_map.get(uri)
+    i = len(namespaces)
+    while prefix is None or prefix in used:
+        prefix = 'ns%d' % i
+        i += 1
+    return prefix
+
+
+def namespace_declarations(namespaces):
+    """
+    Render xmlns attributes declaring the given namespaces.
+    """
+    return ''.join([
+        ' xmlns:{}={}'.format(prefix, quoteattr(uri))
+        for uri, prefix in namespaces.items()
+        if uri != XML_NAMESPACE
+    ])
+
+
+def _qualify(name, namespaces, local):
+    """
+    Turn an ElementTree {uri}name into prefix:name. Namespaces which
+    are not in namespaces (declared on the root) are added to local
+    and have to be declared on the element itself.
+    """
+    if name[:1] != '{':
+        return name
+    uri, local_name = name[1:].split('}', 1)
+    prefix = namespaces.get(uri) or local.get(uri)
+    if prefix is None:
+        used = dict(namespaces)
+        used.update(local)
+        prefix = local[uri] = _new_prefix(uri, used)
+    return prefix + ':' + local_name
+
+
+def _element_markup(tag, names, namespaces):
+    """
+    Build the markup of an element with the given attribute names:
+    its start tag opening (including needed namespace declarations),
+    the attribute name prefixes and its end tag.
+    """
+    local = {}
+    qtag = _qualify(tag, namespaces, local)
+    attrs = [' ' + _qualify(name, namespaces, local) + '=' for name in names]
+    return (
+        '<' + qtag + namespace_declarations(local),
+        attrs,
+        '</' + qtag + '>',
+    )
+
+
+def _serialize_element(write, elem, markup_cache, namespaces,
+                       declarations='', _cname_set=CNAME_SET):
+    """
+    Write a single element and all of its children.
+
+    The tree is walked with an explicit stack instead of recursion which
+    holds either elements still to be written or closing markup (end tag
+    and tail) of elements which are already open. Unlike patching
+    ElementTree's own serializer, elements outside of CNAME_TAGS do not
+    go through an extra wrapper function call. CNAME_SET is bound as a
+    default argument to skip the global lookup.
+
+    Elements mostly share the same attribute names so the markup around
+    the attribute values is built once per distinct tag and names (with
+    namespaced names resolved to prefixes). Values (e.g. failure messages)
+    are mostly unique so they are not part of the key, otherwise the
+    cache would grow with the report. declarations are written on the
+    start tag of elem itself.
+    """
+    stack = [elem]
+    pop = stack.pop
+    push = stack.append
+    extend = stack.extend
+
+    while stack:
+        elem = pop()
+
+        if isinstance(elem, str):
+            write(elem)
+            continue
+
+        tag = elem.tag
+
+        if tag is etree.Comment:
+            write('<!--')
+            write(elem.text or '')
+            write('-->')
+
+        elif tag is etree.ProcessingInstruction:
+            write('<?')
+            write(elem.text or '')
+            write('?>')
+
         else:
-            original_serialize(write, elem, *args, **kwargs)
+            names = tuple(elem.keys())
+            key = (tag, names)
+            markup = markup_cache.get(key)
+            if markup is None:
+                markup = markup_cache[key] = _element_markup(
+                    tag, names, namespaces,
+                )
+            start, attrs, end = markup
+
+            parts = [start]
+            if declarations:
+                parts.append(declarations)
+                declarations = ''
+            for attr, value in zip(attrs, elem.attrib.values()):
+                parts.append(attr)
+                parts.append(_quoteattr(value))
+
+            text = elem.text
+
+            if tag in _cname_set:
+                parts.append('><![CDATA[')
+                # "]]>" cannot appear inside of CDATA so split the section
+                parts.append((text or '').replace(']]>', ']]]]><![CDATA[>'))
+                parts.append(']]>')
+                parts.append(end)
+                write(''.join(parts))
 
-    etree._serialize_xml = etree._serialize['xml'] = _serialize_xml
+            elif text or len(elem):
+                parts.append('>')
+                if text:
+                    parts.append(escape(text))
+                write(''.join(parts))
+                # closing markup is written after all of the children
+                tail = elem.tail
+                push(end + escape(tail) if tail else end)
+                extend(reversed(elem))
+                continue
+
+            else:
+                parts.append(' />')
+                write(''.join(parts))
 
-    yield
+        if elem.tail:
+            write(escape(elem.tail))
 
-    etree._serialize_xml = etree._serialize['xml'] = original_serialize
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yield a temporary path next to the given one which replaces it
+    once everything has been written. On errors the temporary file is
+    removed so that a failed merge (e.g. a malformed report found while
+    streaming) never leaves a partial report behind.
+
+    Symlinks are written through and paths which exist but are not
+    regular files (e.g. /dev/stdout) are written directly.
+    """
+    path = os.path.realpath(path)
+    if os.path.exists(path) and not os.path.isfile(path):
+        yield path
+        return
+
+    tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex[:8])
+    try:
+        yield tmp
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if os.path.exists(path):
+        shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def open_output(output):
+    """
+    Yield a utf-8 text file object for the given output which can
+    either be a file path, a text file object or a binary file object.
+
+    The serializer issues many small writes so files are opened with
+    a large buffer and unbuffered binary streams get wrapped into one.
+    """
+    if not hasattr(output, 'write'):
+        with atomic_path(output) as path:
+            with io.open(path, 'w', encoding='utf-8',
+                         buffering=OUTPUT_BUFFER_SIZE) as fh:
+                yield fh
+
+    elif isinstance(output, io.TextIOBase):
+        yield output
+
+    else:
+        buffered = output
+        if isinstance(output, io.RawIOBase):
+            buffered = io.BufferedWriter(output, OUTPUT_BUFFER_SIZE)
+        fh = io.TextIOWrapper(buffered, encoding='utf-8')
+        try:
+            yield fh
+        finally:
+            fh.flush()
+            fh.detach()
+            # detach so that the caller's stream is not closed
+            # once our wrappers are garbage collected
+            if buffered is not output:
+                buffered.detach()
+
+
+@contextmanager
+def open_binary_output(output):
+    """
+    Yield a binary file object for the given output which can
+    either be a file path or a binary file object.
+    """
+    if not hasattr(output, 'write'):
+        with atomic_path(output) as path:
+            with io.open(path, 'wb', buffering=OUTPUT_BUFFER_SIZE) as fh:
+                yield fh
+    else:
+        yield output
+
+
+def binary_source(f):
+    """
+    Get the binary file object to read the raw bytes of the given
+    file object from or None when it can only be read as text
+    (e.g. io.StringIO).
+    """
+    # text file objects (e.g. from argparse) are read as bytes
+    if hasattr(f, 'buffer'):
+        return f.buffer
+    if isinstance(f, io.TextIOBase):
+        return None
+    return f
+
+
+def copy_report(f, output):
+    """
+    Copy a single xunit xml file byte for byte into the output
+    which can either be a file path or a binary file object.
+    The file must either be a path or have a binary_source.
+    """
+    opened = not hasattr(f, 'read')
+    if opened:
+        src = io.open(f, 'rb')
+    else:
+        src = binary_source(f)
+
+    try:
+        with open_binary_output(output) as dst:
+            shutil.copyfileobj(src, dst, OUTPUT_BUFFER_SIZE)
+    finally:
+        if opened:
+            src.close()
 
 
 def merge_trees(*trees):
@@ -83,26 +417,254 @@ def merge_trees(*trees):
     all of the metadata of how many tests were executed, etc.
     """
     first_tree = trees[0]
-    first_root = first_tree.getroot()
+    merge_roots(first_tree.getroot(), [tree.getroot() for tree in trees[1:]])
+    return first_tree
+
 
-    if len(trees) == 0:
-        return first_tree
+def merge_roots(merged_root, roots):
+    """
+    Append the children of all given roots to merged_root
+    and combine their stats into its attributes.
+    """
+    if not roots:
+        return
 
-    for tree in trees[1:]:
-        root = tree.getroot()
+    # append children elements (testcases) of all roots at once
+    # so the children list of merged_root is grown only once
+    merged_root.extend(chain.from_iterable(roots))
 
-        # append children elements (testcases)
-        first_root.extend(root.getchildren())
+    stats = root_stats(merged_root)
+    for root in roots:
+        add_root_stats(stats, root)
+    set_root_stats(merged_root, stats)
 
-        # combine root attributes which stores the number
-        # of executed tests, skipped tests, etc
-        for key, value in first_root.attrib.items():
-            if not value.isdigit():
-                continue
-            combined = six.text_type(int(value) + int(root.attrib.get(key, '0')))
-            first_root.set(key, combined)
 
-    return first_tree
+def parse_stat(key, value):
+    """
+    Convert the value of a root attribute into a number if it is a stat.
+    time is a float and all other numeric attributes are integer
+    counters. Other and empty values give None. Works with both text
+    and bytes so that merge_xunit_raw can use it as well.
+
+    >>> parse_stat('tests', '5'), parse_stat('time', '5'), parse_stat(b'time', b'1.25')
+    (5, 5.0, 1.25)
+    >>> parse_stat('time', ''), parse_stat('name', 'nosetests')
+    (None, None)
+    """
+    if key in ('time', b'time'):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if value.isdigit():
+        return int(value)
+    return None
+
+
+def root_stats(root):
+    """
+    Get the numeric root attributes which store the number
+    of executed tests, skipped tests, etc. and the total time.
+    """
+    stats = {}
+    for key, value in root.attrib.items():
+        value = parse_stat(key, value)
+        if value is not None:
+            stats[key] = value
+    return stats
+
+
+def add_root_stats(stats, root):
+    """
+    Add the numeric root attributes of another root to stats.
+    Missing or empty values are skipped.
+    """
+    attrib = root.attrib
+    for key in stats:
+        value = parse_stat(key, attrib.get(key, ''))
+        if value is not None:
+            stats[key] += value
+
+
+def set_root_stats(root, stats):
+    """
+    Write the combined stats back as root attributes.
+    """
+    root.attrib.update(
+        (key, format_stat(value)) for key, value in stats.items()
+    )
+
+
+def format_stat(value):
+    """
+    Format a combined stat value as an attribute value.
+
+    Counters are written as plain integers. Time is rounded to
+    microseconds so that float summing does not leak into the report.
+
+    >>> format_stat(5)
+    '5'
+    >>> format_stat(0.1 + 0.2)
+    '0.3'
+    >>> format_stat(0.000005 + 0.000005)
+    '0.00001'
+    >>> format_stat(2.0)
+    '2'
+    """
+    if isinstance(value, float):
+        return ('%.6f' % value).rstrip('0').rstrip('.')
+    return '%d' % value
+
+
+def parse_root(f):
+    """
+    Parse a single xunit xml file and return its root element.
+    """
+    # fresh C XMLParser per file so that a parser patched
+    # into ElementTree by other code is never picked up implicitly
+    return etree.parse(f, parser=etree.XMLParser()).getroot()
+
+
+def parse_merged_root(files):
+    """
+    Parse the given xunit xml files and return the root element
+    of the first file with the children (testcases) of all other
+    files appended to it.
+
+    Every other root is cleared once its children are moved.
+    """
+    roots = [parse_root(f) for f in files]
+
+    if not roots:
+        return None
+
+    merged_root = roots[0]
+    merge_roots(merged_root, roots[1:])
+
+    for root in roots[1:]:
+        root.clear()
+
+    return merged_root
+
+
+def is_seekable(f):
+    """
+    Check if the file can be parsed more than once.
+    """
+    return not hasattr(f, 'read') or f.seekable()
+
+
+def parse_root_start(f):
+    """
+    Parse only the start tag of the root element of a xunit xml file.
+
+    File objects are rewound to where they were so that
+    the file can be parsed again afterwards.
+    """
+    position = f.tell() if hasattr(f, 'read') else None
+
+    events = etree.iterparse(f, events=('start',), parser=etree.XMLParser())
+    _, root = next(events)
+    del events
+
+    if position is not None:
+        f.seek(position)
+
+    # the parser reads ahead so the root can already have some children
+    return etree.Element(root.tag, root.attrib)
+
+
+def stream_merge_xunit(files, output):
+    """
+    Merge the given xunit xml files into the output without building
+    the merged ElementTree.
+
+    The merged root is written first, with the stats combined
+    while reading only the root start tag of every file.
+    Every file is then parsed with iterparse and each top-level child
+    (testcase) is written and discarded as soon as it and its tail are
+    complete, so memory use does not grow with the size of the reports.
+    Files must either be paths or seekable file objects.
+    """
+    if not files:
+        raise ValueError('No xunit files to merge')
+
+    merged_root = None
+    roots = []
+
+    for f in files:
+        root = parse_root_start(f)
+        roots.append(root)
+        if merged_root is None:
+            merged_root = root
+            stats = root_stats(root)
+        else:
+            add_root_stats(stats, root)
+
+    set_root_stats(merged_root, stats)
+
+    # namespaces of the children are only known once they are parsed
+    # so the ones not used by any root are declared where they are used
+    namespaces = collect_namespaces(roots)
+    del roots
+
+    markup_cache = {}
+    start, attrs, end = _element_markup(
+        merged_root.tag, tuple(merged_root.keys()), namespaces,
+    )
+
+    with open_output(output) as fh:
+        write = fh.write
+        write("<?xml version='1.0' encoding='utf-8'?>\n")
+        write(start)
+        write(namespace_declarations(namespaces))
+        for attr, value in zip(attrs, merged_root.attrib.values()):
+            write(attr)
+            write(_quoteattr(value))
+        write('>')
+
+        first_child = True
+
+        for f in files:
+            root = None
+            pending = None
+            depth = 0
+
+            events = etree.iterparse(f, events=('start', 'end'),
+                                     parser=etree.XMLParser())
+
+            # the tail of a child is only set once the next tag is parsed
+            # (which can be in the next chunk read by iterparse) so every
+            # complete child is written when the next child starts or
+            # the root ends
+            for event, elem in events:
+                if event == 'start':
+                    depth += 1
+                    if root is None:
+                        root = elem
+                    elif depth == 2:
+                        if first_child:
+                            # text before the first testcase
+                            # is only known once it starts
+                            write(escape(root.text or ''))
+                            first_child = False
+                        elif pending is not None:
+                            _serialize_element(write, pending,
+                                               markup_cache, namespaces)
+                            # pending is always the first child of root
+                            del root[0]
+                            pending = None
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    pending = elem
+                elif depth == 0 and pending is not None:
+                    _serialize_element(write, pending,
+                                       markup_cache, namespaces)
+                    root.clear()
+
+        write(end)
 
 
 def merge_xunit(files, output, callback=None):
@@ -113,18 +675,264 @@ def merge_xunit(files, output, callback=None):
     before the output file is written (useful for applying other fixes to
     the merged file). This can either modify the element tree in place (and
     return None) or return a completely new ElementTree to be written.
+
+    A single file without a callback has nothing to merge so it is
+    copied as is without being parsed and serialized again. Without a
+    callback multiple files are streamed into the output instead of
+    being merged into a single tree first (see stream_merge_xunit).
+
+    >>> import io
+    >>> def reports():
+    ...     return [
+    ...         io.BytesIO(b'''<?xml version="1.0" encoding="UTF-8"?>
+    ... <testsuite name="nosetests" tests="1" errors="0" failures="1" skip="0">
+    ...     <testcase classname="some.class.Foo" name="test_foo" time="0.001">
+    ...         <failure type="AssertionError" message="Failure">Failure here</failure>
+    ...     </testcase>
+    ... </testsuite>'''),
+    ...         io.BytesIO(b'''<?xml version="1.0" encoding="UTF-8"?>
+    ... <testsuite name="nosetests" tests="1" errors="0" failures="0" skip="0">
+    ...     <testcase classname="some.class.Bar" name="test_bar" time="0.001" />
+    ... </testsuite>'''),
+    ...     ]
+    >>> streamed, merged = io.BytesIO(), io.BytesIO()
+    >>> merge_xunit(reports(), streamed)
+    >>> merge_xunit(reports(), merged, callback=lambda tree: None)
+    >>> streamed.getvalue() == merged.getvalue()
+    True
+    >>> print(streamed.getvalue().decode('utf-8'))
+    <?xml version='1.0' encoding='utf-8'?>
+    <testsuite name="nosetests" tests="2" errors="0" failures="1" skip="0">
+        <testcase classname="some.class.Foo" name="test_foo" time="0.001">
+            <failure type="AssertionError" message="Failure"><![CDATA[Failure here]]></failure>
+        </testcase>
+    <testcase classname="some.class.Bar" name="test_bar" time="0.001" />
+    </testsuite>
+
+    The tail of a testcase is kept even when iterparse reads the
+    report in chunks which end right after the testcase:
+
+    >>> head = b'<testsuite tests="2">\\n    <testcase name="a" padding="'
+    >>> tail = b'"></testcase>'
+    >>> first = head + b'x' * (16 * 1024 - len(head) - len(tail)) + tail
+    >>> len(first)
+    16384
+    >>> report = first + b'\\n    <testcase name="b" />\\n</testsuite>'
+    >>> streamed, merged = io.BytesIO(), io.BytesIO()
+    >>> merge_xunit([io.BytesIO(report), io.BytesIO(report)], streamed)
+    >>> merge_xunit([io.BytesIO(report), io.BytesIO(report)], merged,
+    ...             callback=lambda tree: None)
+    >>> streamed.getvalue() == merged.getvalue()
+    True
+    >>> b'" />\\n    <testcase name="b" />' in streamed.getvalue()
+    True
+
+    A single report is copied byte for byte:
+
+    >>> report, single = reports()[0], io.BytesIO()
+    >>> merge_xunit([report], single)
+    >>> single.getvalue() == report.getvalue()
+    True
+
+    Text reports are parsed instead:
+
+    >>> text, single = io.StringIO(report.getvalue().decode()), io.BytesIO()
+    >>> merge_xunit([text], single)
+    >>> single.getvalue().startswith(b"<?xml version='1.0' encoding='utf-8'?>")
+    True
     """
-    trees = []
+    files = list(files)
 
-    for f in files:
-        trees.append(etree.parse(f))
+    if not files:
+        raise ValueError('No xunit files to merge')
+
+    if (len(files) == 1 and callback is None
+            and not isinstance(output, io.TextIOBase)
+            and (not hasattr(files[0], 'read')
+                 or binary_source(files[0]) is not None)):
+        copy_report(files[0], output)
+        return
 
-    merged = merge_trees(*trees)
+    if callback is None and all(map(is_seekable, files)):
+        stream_merge_xunit(files, output)
+        return
+
+    merged = etree.ElementTree(parse_merged_root(files))
 
     if callback is not None:
         result = callback(merged)
         if result is not None:
             merged = result
 
-    with patch_etree_cname(etree):
-        merged.write(output, encoding='utf-8', xml_declaration=True)
+    with open_output(output) as fh:
+        serialize(merged, fh)
+
+
+def read_report(f):
+    """
+    Read the raw bytes of the xunit xml file which can either
+    be a file path or a file object.
+    """
+    if not hasattr(f, 'read'):
+        with io.open(f, 'rb') as fh:
+            return fh.read()
+    src = binary_source(f)
+    if src is None:
+        return f.read().encode('utf-8')
+    return src.read()
+
+
+def merge_xunit_raw(files, output):
+    """
+    Merge the given xunit xml files into a single output xml file
+    without parsing them into ElementTrees.
+
+    The ``<testcase>`` elements of every file are copied byte for byte
+    and only the root attributes are parsed to combine the counters.
+    This is much faster than merge_xunit but only supports flat utf-8
+    encoded reports (testcases directly under the root, e.g. nosetests)
+    and text is not converted to CDATA. ValueError is raised for
+    reports with anything else under the root, other encodings or
+    namespaces which are not declared on the root of the first report.
+
+    >>> import io
+    >>> first = io.BytesIO(b'''<?xml version="1.0" encoding="UTF-8"?>
+    ... <testsuite name="nosetests" tests="1" errors="0" failures="0" skip="0">
+    ...     <testcase classname="some.class.Foo" name="test_foo" time="0.001" />
+    ... </testsuite>''')
+    >>> second = io.BytesIO(b'''<?xml version="1.0" encoding="UTF-8"?>
+    ... <testsuite name="nosetests" tests="1" errors="1" failures="0" skip="0">
+    ...     <testcase classname="some.class.Bar" name="test_bar" time="0.001">
+    ...         <error type="KeyError" message="Error"><![CDATA[Error here]]></error>
+    ...     </testcase>
+    ... </testsuite>''')
+    >>> output = io.BytesIO()
+    >>> merge_xunit_raw([first, second], output)
+    >>> print(output.getvalue().decode('utf-8'))
+    <?xml version='1.0' encoding='utf-8'?>
+    <testsuite name="nosetests" tests="2" errors="1" failures="0" skip="0">
+    <testcase classname="some.class.Foo" name="test_foo" time="0.001" />
+    <testcase classname="some.class.Bar" name="test_bar" time="0.001">
+            <error type="KeyError" message="Error"><![CDATA[Error here]]></error>
+        </testcase>
+    </testsuite>
+
+    >>> nested = io.BytesIO(b'''<testsuites>
+    ...     <testsuite name="pytest" tests="1">
+    ...         <testcase classname="some.class.Foo" name="test_foo" time="0.001" />
+    ...     </testsuite>
+    ... </testsuites>''')
+    >>> merge_xunit_raw([nested], io.BytesIO())  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: <_io.BytesIO object at ...> is not a flat report with testcases directly under the root so it cannot be merged without parsing
+
+    >>> latin = io.BytesIO(b'''<?xml version="1.0" encoding="latin-1"?>
+    ... <testsuite name="nosetests" tests="0" />''')
+    >>> merge_xunit_raw([latin], io.BytesIO())  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: <_io.BytesIO object at ...> is not utf-8 encoded so it cannot be merged without parsing
+
+    >>> first.seek(0)
+    0
+    >>> prefixed = io.BytesIO(b'''<testsuite xmlns:q="urn:q" tests="1">
+    ...     <testcase name="test_q" q:flag="1" />
+    ... </testsuite>''')
+    >>> merge_xunit_raw([first, prefixed], io.BytesIO())  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: <_io.BytesIO object at ...> declares namespaces which the first report does not declare so it cannot be merged without parsing
+
+    >>> merge_xunit_raw([], io.BytesIO())
+    Traceback (most recent call last):
+    ...
+    ValueError: No xunit files to merge
+    """
+    files = list(files)
+
+    if not files:
+        raise ValueError('No xunit files to merge')
+
+    tag = None
+    attrs = []
+    namespaces = {}
+    stats = {}
+    testcases = []
+
+    for f in files:
+        data = read_report(f)
+        if data.startswith(codecs.BOM_UTF8):
+            data = data[len(codecs.BOM_UTF8):]
+
+        decl = RAW_DECL_RE.match(data)
+        if decl is not None:
+            encoding = decl.group(1) or decl.group(2)
+            try:
+                encoding = codecs.lookup(encoding.decode('latin-1')).name
+            except LookupError:
+                pass
+            if encoding not in ('utf-8', 'ascii'):
+                raise ValueError(NOT_UTF8_ERROR.format(f))
+
+        match = RAW_ROOT_RE.match(data)
+        if match is None:
+            raise ValueError('Could not find root element of {}'.format(f))
+
+        root_attrs = RAW_ATTR_RE.finditer(match.group(2))
+
+        first = tag is None
+        if first:
+            tag = match.group(1)
+
+        for attr in root_attrs:
+            key = attr.group(1)
+            text = attr.group(2) or attr.group(3) or b''
+            if key == b'xmlns' or key.startswith(b'xmlns:'):
+                if first:
+                    namespaces[key] = text
+                elif namespaces.get(key) != text:
+                    raise ValueError(NAMESPACES_ERROR.format(f))
+            if first:
+                attrs.append((key, attr.group(0)))
+            elif key not in stats:
+                continue
+            value = parse_stat(key, text)
+            if value is None:
+                continue
+            if first:
+                stats[key] = value
+            else:
+                stats[key] += value
+
+        position = match.end()
+
+        # self-closing root without any testcases
+        if match.group(2).endswith(b'/'):
+            continue
+
+        for testcase in RAW_TESTCASE_RE.finditer(data, position):
+            if not RAW_GAP_RE.fullmatch(data, position, testcase.start()):
+                raise ValueError(NOT_FLAT_ERROR.format(f))
+            testcases.append(testcase.group(0))
+            position = testcase.end()
+
+        end = RAW_END_RE.fullmatch(data, position)
+        if end is None or end.group(1) != match.group(1):
+            raise ValueError(NOT_FLAT_ERROR.format(f))
+
+    with open_binary_output(output) as fh:
+        fh.write(b"<?xml version='1.0' encoding='utf-8'?>\n<")
+        fh.write(tag)
+        for key, attr in attrs:
+            fh.write(b' ')
+            if key in stats:
+                value = format_stat(stats[key]).encode('ascii')
+                fh.write(key + b'="' + value + b'"')
+            else:
+                fh.write(attr)
+        fh.write(b'>\n')
+        for testcase in testcases:
+            fh.write(testcase)
+            fh.write(b'\n')
+        fh.write(b'</' + tag + b'>')